@@ -0,0 +1,381 @@
+"""Compiled versions of the innermost loops of RRT
+
+Holds the wall collision checks (on their own, through the wall grid, and
+batched into path costs for many paths at once) and the nearest-neighbor
+scans over the nodes that the tree's spatial index hasn't indexed yet.
+
+These are run on every step of RRT (and many times per step of RRT*) so are
+written as scalar loops for numba to compile. numba is optional: if it is not
+installed, HAS_NUMBA is False and the spaces and tree use their NumPy
+versions instead
+
+"""
+
+from __future__ import division, print_function
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Stand-in decorator that leaves functions uncompiled"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+__all__ = ['HAS_NUMBA', 'collision_free_2d', 'first_wall_crossing_2d',
+           'collision_free_grid_2d', 'first_wall_crossing_grid_2d',
+           'path_costs_2d', 'path_costs_from_2d', 'nearest_idx', 'near_idx']
+
+# Fast math flags, but without nnan/ninf since inf marks "no crossing"
+_FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+@njit(inline='always')
+def _point_in_box(px, py, llx, lly, urx, ury):
+    return px >= llx and px <= urx and py >= lly and py <= ury
+
+
+@njit(inline='always')
+def _crossing(px, py, rx, ry, qx, qy, sx, sy):
+    """Fraction along p + t*r where it crosses q + u*s (inf if it misses)"""
+    denom = rx * sy - ry * sx
+    if denom == 0:
+        return np.inf
+    t = ((qx - px) * sy - (qy - py) * sx) / denom
+    u = ((qx - px) * ry - (qy - py) * rx) / denom
+    if t >= 0 and t <= 1 and u >= 0 and u <= 1:
+        return t
+    return np.inf
+
+
+@njit(inline='always')
+def _first_border_crossing(px, py, rx, ry, llx, lly, urx, ury):
+    """Smallest crossing fraction of p + t*r over the four wall borders"""
+    t = min(_crossing(px, py, rx, ry, llx, lly, 0., ury - lly),
+            _crossing(px, py, rx, ry, llx, lly, urx - llx, 0.))
+    t = min(t, _crossing(px, py, rx, ry, llx, ury, urx - llx, 0.))
+    return min(t, _crossing(px, py, rx, ry, urx, lly, 0., ury - lly))
+
+
+@njit(inline='always')
+def _wall_blocks(pfx, pfy, ptx, pty, min_x, min_y, max_x, max_y,
+                 llx, lly, urx, ury):
+    """Whether a path (with the given bounding box) is blocked by a wall"""
+    if min_x > urx or min_y > ury or max_x < llx or max_y < lly:
+        return False
+    if (_point_in_box(pfx, pfy, llx, lly, urx, ury) or
+            _point_in_box(ptx, pty, llx, lly, urx, ury)):
+        return True
+    return np.isfinite(_first_border_crossing(pfx, pfy, ptx - pfx, pty - pfy,
+                                              llx, lly, urx, ury))
+
+
+@njit(inline='always')
+def _wall_crossing(pfx, pfy, ptx, pty, min_x, min_y, max_x, max_y,
+                   llx, lly, urx, ury):
+    """Fraction along a path where it first crosses a wall (or inf)"""
+    if min_x > urx or min_y > ury or max_x < llx or max_y < lly:
+        return np.inf
+    return _first_border_crossing(pfx, pfy, ptx - pfx, pty - pfy,
+                                  llx, lly, urx, ury)
+
+
+@njit(inline='always')
+def _cell_index(v, inv_cell_size, n):
+    """The grid cell holding a coordinate, clipped into the grid"""
+    return min(max(int(np.floor(v * inv_cell_size)), 0), n - 1)
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def collision_free_2d(pfx, pfy, ptx, pty, dimsx, dimsy, walls_ll, walls_ur):
+    """Determines whether a path is in bounds and clear of all walls
+
+    Args:
+        pfx, pfy (float): the point to move from
+        ptx, pty (float): the point to move to
+        dimsx, dimsy (float): the dimensions of the space
+        walls_ll (np.array): (W, 2) float64 array of lower-left wall corners
+        walls_ur (np.array): (W, 2) float64 array of upper-right wall corners
+
+    Returns:
+        Boolean indicating whether there is a clear linear path
+    """
+    if not (pfx > 0 and pfx < dimsx and pfy > 0 and pfy < dimsy and
+            ptx > 0 and ptx < dimsx and pty > 0 and pty < dimsy):
+        return False
+    min_x = min(pfx, ptx)
+    max_x = max(pfx, ptx)
+    min_y = min(pfy, pty)
+    max_y = max(pfy, pty)
+    for i in range(walls_ll.shape[0]):
+        if _wall_blocks(pfx, pfy, ptx, pty, min_x, min_y, max_x, max_y,
+                        walls_ll[i, 0], walls_ll[i, 1],
+                        walls_ur[i, 0], walls_ur[i, 1]):
+            return False
+    return True
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def collision_free_grid_2d(pfx, pfy, ptx, pty, dimsx, dimsy, walls_ll,
+                           walls_ur, grid):
+    """Like collision_free_2d, but only checks the walls in the grid cells
+    that the path's bounding box touches
+
+    Args:
+        pfx, pfy (float): the point to move from
+        ptx, pty (float): the point to move to
+        dimsx, dimsy (float): the dimensions of the space
+        walls_ll (np.array): (W, 2) float64 array of lower-left wall corners
+        walls_ur (np.array): (W, 2) float64 array of upper-right wall corners
+        grid (tuple): the wall grid as (1 / cell_size, ncx, ncy,
+                      cell_start, cell_walls, wall_cells); the walls in cell
+                      (i, j) are cell_walls[cell_start[c]:cell_start[c+1]]
+                      for c = i*ncy + j, and wall_cells holds the first cell
+                      (i, j) of each wall
+
+    Returns:
+        Boolean indicating whether there is a clear linear path
+    """
+    if not (pfx > 0 and pfx < dimsx and pfy > 0 and pfy < dimsy and
+            ptx > 0 and ptx < dimsx and pty > 0 and pty < dimsy):
+        return False
+    inv_cell_size, ncx, ncy, cell_start, cell_walls, wall_cells = grid
+    min_x = min(pfx, ptx)
+    max_x = max(pfx, ptx)
+    min_y = min(pfy, pty)
+    max_y = max(pfy, pty)
+    x0 = _cell_index(min_x, inv_cell_size, ncx)
+    x1 = _cell_index(max_x, inv_cell_size, ncx)
+    y0 = _cell_index(min_y, inv_cell_size, ncy)
+    y1 = _cell_index(max_y, inv_cell_size, ncy)
+    # Long paths touch more cells than there are walls to scan
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > walls_ll.shape[0]:
+        return collision_free_2d(pfx, pfy, ptx, pty, dimsx, dimsy,
+                                 walls_ll, walls_ur)
+    for i in range(x0, x1 + 1):
+        for j in range(y0, y1 + 1):
+            c = i * ncy + j
+            for k in range(cell_start[c], cell_start[c + 1]):
+                w = cell_walls[k]
+                # Walls covering many cells are only checked in the first
+                # one they share with the path
+                if (max(wall_cells[w, 0], x0) != i or
+                        max(wall_cells[w, 1], y0) != j):
+                    continue
+                if _wall_blocks(pfx, pfy, ptx, pty, min_x, min_y, max_x,
+                                max_y, walls_ll[w, 0], walls_ll[w, 1],
+                                walls_ur[w, 0], walls_ur[w, 1]):
+                    return False
+    return True
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def first_wall_crossing_2d(pfx, pfy, ptx, pty, walls_ll, walls_ur):
+    """Finds the first point along a path where it crosses a wall border
+
+    Args:
+        pfx, pfy (float): the point to move from
+        ptx, pty (float): the point to move to
+        walls_ll (np.array): (W, 2) float64 array of lower-left wall corners
+        walls_ur (np.array): (W, 2) float64 array of upper-right wall corners
+
+    Returns:
+        The fraction of the way along the path of the first crossing (or inf
+        if no walls are crossed)
+    """
+    min_x = min(pfx, ptx)
+    max_x = max(pfx, ptx)
+    min_y = min(pfy, pty)
+    max_y = max(pfy, pty)
+    first = np.inf
+    for i in range(walls_ll.shape[0]):
+        first = min(first, _wall_crossing(pfx, pfy, ptx, pty, min_x, min_y,
+                                          max_x, max_y, walls_ll[i, 0],
+                                          walls_ll[i, 1], walls_ur[i, 0],
+                                          walls_ur[i, 1]))
+    return first
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def first_wall_crossing_grid_2d(pfx, pfy, ptx, pty, walls_ll, walls_ur,
+                                grid):
+    """Like first_wall_crossing_2d, but only checks the walls in the grid
+    cells that the path's bounding box touches
+
+    Args:
+        pfx, pfy (float): the point to move from
+        ptx, pty (float): the point to move to
+        walls_ll (np.array): (W, 2) float64 array of lower-left wall corners
+        walls_ur (np.array): (W, 2) float64 array of upper-right wall corners
+        grid (tuple): the wall grid (see collision_free_grid_2d)
+
+    Returns:
+        The fraction of the way along the path of the first crossing (or inf
+        if no walls are crossed)
+    """
+    inv_cell_size, ncx, ncy, cell_start, cell_walls, wall_cells = grid
+    min_x = min(pfx, ptx)
+    max_x = max(pfx, ptx)
+    min_y = min(pfy, pty)
+    max_y = max(pfy, pty)
+    x0 = _cell_index(min_x, inv_cell_size, ncx)
+    x1 = _cell_index(max_x, inv_cell_size, ncx)
+    y0 = _cell_index(min_y, inv_cell_size, ncy)
+    y1 = _cell_index(max_y, inv_cell_size, ncy)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > walls_ll.shape[0]:
+        return first_wall_crossing_2d(pfx, pfy, ptx, pty, walls_ll, walls_ur)
+    first = np.inf
+    for i in range(x0, x1 + 1):
+        for j in range(y0, y1 + 1):
+            c = i * ncy + j
+            for k in range(cell_start[c], cell_start[c + 1]):
+                w = cell_walls[k]
+                if (max(wall_cells[w, 0], x0) != i or
+                        max(wall_cells[w, 1], y0) != j):
+                    continue
+                first = min(first, _wall_crossing(pfx, pfy, ptx, pty, min_x,
+                                                  min_y, max_x, max_y,
+                                                  walls_ll[w, 0],
+                                                  walls_ll[w, 1],
+                                                  walls_ur[w, 0],
+                                                  walls_ur[w, 1]))
+    return first
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def path_costs_2d(points_from, points_to, dimsx, dimsy, walls_ll, walls_ur,
+                  grid, use_grid):
+    """Finds the cost of each of a set of paths through the walls
+
+    Args:
+        points_from (np.array): (K, 2) float64 array of points to move from
+        points_to (np.array): (K, 2) float64 array of points to move to
+        dimsx, dimsy (float): the dimensions of the space
+        walls_ll (np.array): (W, 2) float64 array of lower-left wall corners
+        walls_ur (np.array): (W, 2) float64 array of upper-right wall corners
+        grid (tuple): the wall grid (see collision_free_grid_2d)
+        use_grid (bool): whether to check the walls through the grid
+
+    Returns:
+        A (K,) array of path lengths (inf where the path is blocked)
+    """
+    costs = np.empty(points_from.shape[0])
+    for i in range(points_from.shape[0]):
+        pfx = points_from[i, 0]
+        pfy = points_from[i, 1]
+        ptx = points_to[i, 0]
+        pty = points_to[i, 1]
+        if use_grid:
+            free = collision_free_grid_2d(pfx, pfy, ptx, pty, dimsx, dimsy,
+                                          walls_ll, walls_ur, grid)
+        else:
+            free = collision_free_2d(pfx, pfy, ptx, pty, dimsx, dimsy,
+                                     walls_ll, walls_ur)
+        if free:
+            costs[i] = np.sqrt((ptx - pfx) ** 2 + (pty - pfy) ** 2)
+        else:
+            costs[i] = np.inf
+    return costs
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def path_costs_from_2d(pfx, pfy, points_to, dimsx, dimsy, walls_ll, walls_ur,
+                       grid, use_grid):
+    """Finds the cost of paths from one point out to each of a set of points
+
+    Used for the RRT* rewiring check from a new node to its neighbors. That
+    is usually only a handful of paths, too few to be worth splitting across
+    threads
+
+    Args:
+        pfx, pfy (float): the point to move from
+        points_to (np.array): (K, 2) float64 array of points to move to
+        dimsx, dimsy (float): the dimensions of the space
+        walls_ll (np.array): (W, 2) float64 array of lower-left wall corners
+        walls_ur (np.array): (W, 2) float64 array of upper-right wall corners
+        grid (tuple): the wall grid (see collision_free_grid_2d)
+        use_grid (bool): whether to check the walls through the grid
+
+    Returns:
+        A (K,) array of path lengths (inf where the path is blocked)
+    """
+    costs = np.empty(points_to.shape[0])
+    for i in range(points_to.shape[0]):
+        ptx = points_to[i, 0]
+        pty = points_to[i, 1]
+        if use_grid:
+            free = collision_free_grid_2d(pfx, pfy, ptx, pty, dimsx, dimsy,
+                                          walls_ll, walls_ur, grid)
+        else:
+            free = collision_free_2d(pfx, pfy, ptx, pty, dimsx, dimsy,
+                                     walls_ll, walls_ur)
+        if free:
+            costs[i] = np.sqrt((ptx - pfx) ** 2 + (pty - pfy) ** 2)
+        else:
+            costs[i] = np.inf
+    return costs
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def nearest_idx(points, idx, free, q):
+    """Finds the closest free point to q among a subset of points
+
+    Args:
+        points (np.array): (N, d) float64 array of points
+        idx (np.array): indices into points to search over
+        free (np.array): (N,) boolean mask of which points can be returned
+        q (np.array): (d,) float64 point to search around
+
+    Returns:
+        The index of the closest free point (or -1 if there are none) and its
+        squared distance to q
+    """
+    best = -1
+    best_d2 = np.inf
+    for k in range(idx.shape[0]):
+        i = idx[k]
+        if not free[i]:
+            continue
+        d2 = 0.
+        for j in range(points.shape[1]):
+            diff = points[i, j] - q[j]
+            d2 += diff * diff
+        if d2 < best_d2:
+            best_d2 = d2
+            best = i
+    return best, best_d2
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def near_idx(points, idx, free, q, r2):
+    """Finds all free points within a squared distance of q among a subset
+    of points
+
+    Args:
+        points (np.array): (N, d) float64 array of points
+        idx (np.array): indices into points to search over
+        free (np.array): (N,) boolean mask of which points can be returned
+        q (np.array): (d,) float64 point to search around
+        r2 (float): the squared distance to search within
+
+    Returns:
+        An array of the indices of the points found
+    """
+    found = np.empty(idx.shape[0], dtype=np.intp)
+    n = 0
+    for k in range(idx.shape[0]):
+        i = idx[k]
+        if not free[i]:
+            continue
+        d2 = 0.
+        for j in range(points.shape[1]):
+            diff = points[i, j] - q[j]
+            d2 += diff * diff
+        if d2 <= r2:
+            found[n] = i
+            n += 1
+    return found[:n]
@@ -2,69 +2,55 @@
 
 from __future__ import division, print_function
 import numpy as np
-import pygame as pg
 
 
-def point_in_box(min_verts, max_verts, point):
-    return (np.all(point >= min_verts) and np.all(point <= max_verts))
-
-
-def _line_intersect_circle(center, rad, p1, p2):
-    # Make sure p1 is to the left of p2
-    if p2[0] < p1[0]:
-        ptmp = p2
-        p2 = p1
-        p1 = ptmp
-    # Get Ax + By + C = 0 equation from points
-    a = p1[1] - p2[1]
-    b = p2[0] - p1[0]
-    c = p1[0] * p2[1] - p2[0] * p1[1]
-    # Find the foot of the perpendicular to the center point
-    foot_term = -(a * center[0] + b * center[1] + c) / (a * a + b * b)
-    foot_x = foot_term * a + center[0]
-    foot_y = foot_term * b + center[1]
-    # If the distance between the foot and circle is more than the radius,
-    #  there is no intersection
-    if np.linalg.norm(center - np.array([foot_x, foot_y])) > rad:
-        return False
-    # If the foot isn't on the segment, there is no intersection
-    if foot_x < p1[0] or foot_x > p2[0]:
-        return False
-    return True
-
-
-def _ball_intersect_rect(bcenter, brad, rll, rur):
-    rverts = [[rll[0], rll[1]], [rll[0], rur[1]],
-              [rur[0], rur[1]], [rur[0], rll[1]]]
-    return (point_in_box(rll, rur, bcenter) or
-            _line_intersect_circle(bcenter, brad, rverts[0], rverts[1]) or
-            _line_intersect_circle(bcenter, brad, rverts[1], rverts[2]) or
-            _line_intersect_circle(bcenter, brad, rverts[2], rverts[3]) or
-            _line_intersect_circle(bcenter, brad, rverts[3], rverts[0]))
+def segment_crossings(p1, p2, q1, q2):
+    """Finds where the segment p1->p2 crosses each of a set of segments
+
+    All arguments broadcast against each other, so many paths can be checked
+    against many segments at once
+
+    Args:
+        p1 (np.array): a (..., 2) array of path segment start points
+        p2 (np.array): a (..., 2) array of path segment end points
+        q1 (np.array): a (..., 2) array of the other segments' start points
+        q2 (np.array): a (..., 2) array of the other segments' end points
+
+    Returns:
+        An array of the fraction along p1->p2 where each segment is crossed
+        (inf for segments that are not crossed or are parallel)
+    """
+    r = p2 - p1
+    s = q2 - q1
+    qp = q1 - p1
+    denom = r[..., 0] * s[..., 1] - r[..., 1] * s[..., 0]
+    # Compare numerators against |denom| to avoid dividing by zero
+    sign = np.where(denom < 0, -1., 1.)
+    absden = denom * sign
+    t_num = (qp[..., 0] * s[..., 1] - qp[..., 1] * s[..., 0]) * sign
+    u_num = (qp[..., 0] * r[..., 1] - qp[..., 1] * r[..., 0]) * sign
+    hit = ((absden > 0) & (t_num >= 0) & (t_num <= absden) &
+           (u_num >= 0) & (u_num <= absden))
+    return np.where(hit, t_num / np.where(hit, absden, 1.), np.inf)
 
 
 def ball_intersect(bcent, rad, wall):
-    bleft = bcent[0] - rad
-    btop = bcent[1] - rad
-    brect = pg.Rect(bleft, btop, rad * 2, rad * 2)
+    """Determines whether a ball overlaps with a rectangular wall
 
-    wl, wu = wall[0]
-    wr, wb = wall[1]
-    rect = pg.Rect(wl, wu, wr - wl, wb - wu)
+    Finds the point on the wall closest to the ball's center and checks
+    whether it is within the radius
 
-    if rect.colliderect(brect):
-        if rect.contains(brect):
-            return True
-        if brect.bottom > rect.top or brect.top < rect.bottom:
-            if bcent[0] > rect.left and bcent[0] < rect.right:
-                return True
-        if brect.right > rect.left or brect.left < rect.right:
-            if bcent[1] > rect.top and bcent[1] < rect.bottom:
-                return True
+    Args:
+        bcent (list/np.array): the (x, y) center of the ball
+        rad (float): the radius of the ball
+        wall ([ul, lr]): the (left, top) and (right, bottom) wall corners
 
-        return any(map(lambda pt:
-                       np.linalg.norm(np.array(pt) - np.array(bcent)) <= rad,
-                       [rect.topleft, rect.topright,
-                        rect.bottomleft, rect.bottomright]))
-    else:
-        return False
+    Returns:
+        Boolean indicating whether the ball touches the wall
+    """
+    cx, cy = bcent
+    wl, wt = wall[0]
+    wr, wb = wall[1]
+    dx = cx - min(max(cx, wl), wr)
+    dy = cy - min(max(cy, wt), wb)
+    return dx * dx + dy * dy <= rad * rad
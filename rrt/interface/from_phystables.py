@@ -30,21 +30,25 @@ def load_phystable_trial(trial, goaltypes=[], ball_expand=True):
 
     # Go through the walls & goals to parse into Space walls & goals
     glist = []
-    wlist = []
     if ball_expand:
         expd = trial.ball[2]
     else:
         expd = 0
 
-    for w in trial.normwalls:
-        wlist.append([np.array(w[0]) - expd, np.array(w[1]) + expd])
-    for g in trial.goals:
+    # Expand all of the corners at once as (N, 2) float64 arrays
+    def _corners(boxes, i):
+        return np.reshape([b[i] for b in boxes], (-1, 2)).astype(np.float64)
+
+    wll = _corners(trial.normwalls, 0) - expd
+    wur = _corners(trial.normwalls, 1) + expd
+    wlist = [[ll, ur] for ll, ur in zip(wll, wur)]
+    gll = _corners(trial.goals, 0) - expd
+    gur = _corners(trial.goals, 1) + expd
+    for g, ll, ur in zip(trial.goals, gll, gur):
         if g[2] in goaltypes:
-            glist.append(BoxGoal2D(np.array(g[0]) - expd,
-                                   np.array(g[1]) + expd))
+            glist.append(BoxGoal2D(ll, ur))
         else:
             # Unloved goals become walls
-            wlist.append([np.array(g[0]) - expd,
-                          np.array(g[1]) + expd])
+            wlist.append([ll, ur])
 
     return WallSpace(trial.dims, glist, wlist)
@@ -6,9 +6,10 @@ important methods that are used for RRT planning
 """
 
 from __future__ import division, print_function
-from .tree import *
+from .tree import DirectedTree
 from .space import EmptySpace
 import numpy as np
+import math
 
 __all__ = ["RRT"]
 
@@ -31,8 +32,10 @@ class RRT(object):
         if step_size is None:
             step_size = np.sqrt(sum(self._dims * self._dims))
         self._ssize = step_size
+        self._ssize2 = step_size * step_size
         self._tree = DirectedTree(initial_point)
         self._tol = min(self._dims) * 1e-6 # Distance to make a point "new"
+        self._tol2 = self._tol * self._tol
 
     def steer(self, point_from, point_to):
         """Returns a point that gets moved to when steering towards a desired
@@ -46,14 +49,36 @@ class RRT(object):
             The new point to end at -- either the point moved to or a point
             in that direction of step_size set for the RRT
         """
-        vdiff = point_to - point_from
+        dx = point_to[0] - point_from[0]
+        dy = point_to[1] - point_from[1]
         # Are these points within the max step size? Then we're cool
-        vlen = np.linalg.norm(vdiff)
-        if vlen < self._ssize:
+        vlen2 = dx * dx + dy * dy
+        if vlen2 < self._ssize2:
             return point_to
         # Otherwise, step with max step size in the direction of point_to
-        voffset = vdiff * self._ssize / vlen
-        return point_from + voffset
+        scale = self._ssize / math.sqrt(vlen2)
+        return np.array([point_from[0] + dx * scale,
+                         point_from[1] + dy * scale])
+
+    def steer_batch(self, points_from, point_to):
+        """Steers from each of a set of points towards a single point
+
+        Args:
+            points_from (np.array): (K, 2) array of points to start at
+            point_to (np.array): The (x, y) point to direct towards
+
+        Returns:
+            A (K, 2) array of the points to end at (see steer)
+        """
+        vdiff = point_to - points_from
+        vlen2 = np.einsum('ij,ij->i', vdiff, vdiff)
+        q_paths = np.empty(points_from.shape)
+        q_paths[:] = point_to
+        # Points beyond the max step size only go step_size towards point_to
+        far = vlen2 >= self._ssize2
+        scale = self._ssize / np.sqrt(vlen2[far])
+        q_paths[far] = points_from[far] + vdiff[far] * scale[:, np.newaxis]
+        return q_paths
 
     def step(self):
         """Runs one step of the RRT algorithm to create a single new node
@@ -80,7 +105,9 @@ class RRT(object):
             # Here there is a blocker... find the nearest point
             q_path = self._space.get_nearest_free_point(q_nearest, q_path)
             # Is this actually a new point? If not, skip
-            if np.linalg.norm(q_nearest - q_path) < self._tol:
+            dx = q_path[0] - q_nearest[0]
+            dy = q_path[1] - q_nearest[1]
+            if dx * dx + dy * dy < self._tol2:
                 return None
             cost_path = self._space.get_path_cost(q_nearest, q_path)
         # Hook this new point up to the tree
@@ -99,20 +126,17 @@ class RRT(object):
                 (2) A list of all points traversed on that path
             (Note this will be inf, None if no path has been found)
         """
-        # Make sure we have found one
-        goal_nodes = self._tree.goal_nodes
-        if len(goal_nodes) == 0:
+        # Make sure we have found one (the tree tracks the shortest)
+        end_node = self._tree.best_goal
+        if end_node is None:
             return np.inf, None
 
-        # Find the node with the shortest path
-        costs = np.array([n.cost for n in goal_nodes])
-        end_node = goal_nodes[np.argmin(costs)]
         # Return cost, path
         return end_node.cost, [p.point for p in self._tree.path_down(end_node)]
 
     def found_path(self):
         """Returns True if a path to the goal has been found, False otherwise"""
-        return len(self._tree.goal_nodes) > 0
+        return self._tree.best_goal is not None
 
     def _expose_tree(self):
         return self._tree
@@ -5,7 +5,6 @@ the nodes
 """
 
 from __future__ import division, print_function
-from .tree import *
 from .rrt_base import RRT
 import numpy as np
 
@@ -50,56 +49,86 @@ class RRTstar(RRT):
         """
         # Pick a random point from the space
         q_rand = self._space.get_random_free_point()
-        # Find the neighbors in the tree
-        Q_near = self._tree.near(q_rand, self._close)
+        # Find the neighbors in the tree (as indices into the tree arrays)
+        tree = self._tree
+        near_idx = tree.near_indices(q_rand, self._close)
         # Check -- if everything too far, just use the nearest
-        if len(Q_near) == 0:
+        if len(near_idx) == 0:
             # Replicate the RRT basic step
             return RRT._step_to(self, q_rand)
         else:
-            # Find the minimum cost in the neighborhood
-            cost_min = np.inf
-            new_cost_min = np.inf
-            node_min = None
-            steer_min = None
-            for node_near in Q_near:
-                # Figure out the point to move to
-                q_near = node_near.point
-                q_path = self.steer(q_near, q_rand)
-                cost_path = self._space.get_path_cost(q_near, q_path)
-                if np.isinf(cost_path):
-                    q_path = self._space.get_nearest_free_point(q_near, q_path)
-                    # If it's the same point, treat as inf cost
-                    if np.linalg.norm(q_near - q_path) < self._tol:
-                        cost_path = np.inf
-                    else:
-                        cost_path = self._space.get_path_cost(q_near, q_path)
-                tot_cost = node_near.cost + cost_path
-                # Check whether this is a new minimum
-                if tot_cost < cost_min:
-                    cost_min = tot_cost
-                    new_cost_min = cost_path
-                    node_min = node_near
-                    steer_min = q_path
+            # Find the minimum cost in the neighborhood, steering from and
+            # costing the paths of all neighbors at once
+            q_nears = tree.point_array[near_idx]
+            q_paths = self.steer_batch(q_nears, q_rand)
+            costs = self._space.get_path_cost_batch(q_nears, q_paths)
+            # Keep the costs to the steered points to reuse when rewiring
+            steered, steered_costs = q_paths.copy(), costs.copy()
+            near_costs = tree.cost_array[near_idx]
+            tot_costs = near_costs + costs
+            best_cost = np.min(tot_costs)
+            # Blocked neighbors can only get partway, so they can't beat the
+            # best clear path unless they start out cheaper -- try them
+            # cheapest first, stopping once none of the rest can
+            blocked = np.flatnonzero(np.isinf(costs))
+            for i in blocked[np.argsort(near_costs[blocked])]:
+                if near_costs[i] >= best_cost:
+                    break
+                q_near = q_nears[i]
+                q_path = self._space.get_nearest_free_point(q_near,
+                                                            q_paths[i])
+                # If it's the same point, treat as inf cost
+                dx = q_path[0] - q_near[0]
+                dy = q_path[1] - q_near[1]
+                if dx * dx + dy * dy >= self._tol2:
+                    q_paths[i] = q_path
+                    costs[i] = self._space.get_path_cost(q_near, q_path)
+                    tot_costs[i] = near_costs[i] + costs[i]
+                    best_cost = min(best_cost, tot_costs[i])
+            i_min = np.argmin(tot_costs)
             # Degenerate case: can't move to a new node
-            if node_min is None:
+            if np.isinf(tot_costs[i_min]):
                 return None
+            node_min = tree.nodes[near_idx[i_min]]
+            steer_min = q_paths[i_min]
+            new_cost_min = costs[i_min]
             # If it's good, we add this to the tree
-            new_node = self._tree.add_node(node_min, steer_min, new_cost_min)
+            new_node = tree.add_node(node_min, steer_min, new_cost_min)
             q_path = new_node.point
             if self._space.check_point_in_goals(q_path):
                 new_node.mark_goal()
+            # Neighbors that steered to the new point already have its cost
+            same = np.all(steered == steer_min, axis=1)
+            reuse = dict(zip(near_idx[same], steered_costs[same]))
             # Then we rewire the tree
             # Look within either the step size or closeness (the min of those)
-            for node_near in self._tree.near(q_path,
-                                             min(self._ssize, self._close)):
-                q_near = node_near.point
-                cost_new = self._space.get_path_cost(q_path, q_near)
-                # If there's a path
-                if not np.isinf(cost_new):
-                    # Figure out the total cost
-                    total_cost_new = cost_new + new_node.cost
-                    # If it's less than the existing cost, reparent
-                    if total_cost_new < node_near.cost:
-                        node_near.reparent(new_node, cost_new)
+            rewire_idx = tree.near_indices(q_path, min(self._ssize,
+                                                       self._close))
+            rewire_idx = rewire_idx[rewire_idx != new_node.index]
+            # A node can only be improved if the straight line from the new
+            # node is short enough, which is checked on squared distances so
+            # that the rest never need a square root or collision check
+            slack = tree.cost_array[rewire_idx] - new_node.cost
+            diff = tree.point_array[rewire_idx] - q_path
+            dist2 = np.einsum('ij,ij->i', diff, diff)
+            rewire_idx = rewire_idx[(slack > 0) & (dist2 < slack * slack)]
+            # Path costs are symmetric (Euclidean length, and walls block
+            # travel both ways), so the first pass costs can be reused;
+            # the rest are found all at once
+            rewire_costs = np.array([reuse.get(i, np.nan) for i in rewire_idx])
+            unknown = np.isnan(rewire_costs)
+            if np.any(unknown):
+                rewire_costs[unknown] = self._space.get_path_costs_from(
+                    q_path, tree.point_array[rewire_idx[unknown]])
+            # Rewiring only lowers costs, so any node that isn't improved now
+            # won't be later on
+            total_costs_new = rewire_costs + new_node.cost
+            better = total_costs_new < tree.cost_array[rewire_idx]
+            # Reparenting changes the tree, so this part stays in order
+            for i, cost_new, total_cost_new in zip(rewire_idx[better],
+                                                   rewire_costs[better],
+                                                   total_costs_new[better]):
+                # If it's still less than the existing cost, reparent
+                if total_cost_new < tree.cost_array[i]:
+                    tree.nodes[i].reparent(new_node, cost_new)
             return new_node
@@ -6,10 +6,14 @@ Two types: EmptySpace (which is a empty, rectangular table), and WallSpace
 """
 
 from __future__ import division, print_function
-from .goals import *
+from .goals import BoxGoal2D
 import numpy as np
-from geometry import find_intersection_point, lines_intersect
-from .helpers import point_in_box
+import math
+from geometry import find_intersection_point
+from .helpers import segment_crossings
+from ._kernels import (HAS_NUMBA, collision_free_2d, first_wall_crossing_2d,
+                       collision_free_grid_2d, first_wall_crossing_grid_2d,
+                       path_costs_2d, path_costs_from_2d)
 
 class EmptySpace(object):
     """The most basic space with no obstacles"""
@@ -23,7 +27,17 @@ class EmptySpace(object):
 
         """
         self._dims = dimensions
+        self._dimsx = float(dimensions[0])
+        self._dimsy = float(dimensions[1])
         self._goals = goals
+        # Box goals can all be checked at once from (G, 2) corner arrays
+        if all(isinstance(g, BoxGoal2D) for g in goals):
+            self._goals_ll = np.reshape(
+                [g.extent['lower_left'] for g in goals], (-1, 2))
+            self._goals_ur = np.reshape(
+                [g.extent['upper_right'] for g in goals], (-1, 2))
+        else:
+            self._goals_ll = self._goals_ur = None
 
     def _get_dimensions(self):
         return self._dims
@@ -39,12 +53,15 @@ class EmptySpace(object):
         """Inverts a point -- used for drawing since the convention is y->up
 
         Args:
-            point (np.array): (x, y) point to invert
+            point (np.array): (x, y) point to invert, or an (N, 2) array of
+                              points to invert all at once
 
         Returns:
-            Another point flipped in the y dimension
+            Another point (or array of points) flipped in the y dimension
         """
-        return np.array([point[0], self._dims[1]-point[1]])
+        inv = np.array(point, dtype=float)[..., :2]
+        inv[..., 1] = self._dims[1] - inv[..., 1]
+        return inv
 
     def collision_free(self, point_from, point_to):
         """Determines if there is a collision moving between two points
@@ -59,8 +76,10 @@ class EmptySpace(object):
             Boolean indicating whether there is a clear linear path between the
             two points
         """
-        return (np.all(point_from > 0) and np.all(point_from < self._dims) and
-                np.all(point_to > 0) and np.all(point_to < self._dims))
+        return (0 < point_from[0] < self._dimsx and
+                0 < point_from[1] < self._dimsy and
+                0 < point_to[0] < self._dimsx and
+                0 < point_to[1] < self._dimsy)
 
     def get_path_cost(self, point_from, point_to):
         """Determines the cost for traversing from point_from to point_to
@@ -79,7 +98,42 @@ class EmptySpace(object):
         if not self.collision_free(point_from, point_to):
             return np.inf
 
-        return np.linalg.norm(point_from - point_to)
+        return math.hypot(point_from[0] - point_to[0],
+                          point_from[1] - point_to[1])
+
+    def get_path_cost_batch(self, points_from, points_to):
+        """Determines the costs for traversing between many pairs of points
+
+        Args:
+            points_from (np.array): (K, 2) array of points to move from
+            points_to (np.array): (K, 2) array of points to move to
+
+        Returns:
+            A (K,) array of the distances between the points (inf for any
+            paths with a collision)
+        """
+        in_bounds = (np.all(points_from > 0, 1) &
+                     np.all(points_from < self._dims, 1) &
+                     np.all(points_to > 0, 1) &
+                     np.all(points_to < self._dims, 1))
+        vdiff = points_to - points_from
+        costs = np.hypot(vdiff[:, 0], vdiff[:, 1])
+        costs[~in_bounds] = np.inf
+        return costs
+
+    def get_path_costs_from(self, point_from, points_to):
+        """Determines the costs for traversing from one point to many others
+
+        Args:
+            point_from (np.array): point in the space to move from
+            points_to (np.array): (K, 2) array of points to move to
+
+        Returns:
+            A (K,) array of the path costs (inf for any paths with a
+            collision)
+        """
+        points_from = np.broadcast_to(point_from, np.shape(points_to))
+        return self.get_path_cost_batch(points_from, points_to)
 
     def get_nearest_free_point(self, point_from, point_to):
         """Returns the nearest legal point on a path
@@ -119,7 +173,9 @@ class EmptySpace(object):
         Returns:
             Boolean indicating whether the new point is in one of the goals
         """
-        #return np.any(g.point_in(point) for g in self._goals)
+        if self._goals_ll is not None:
+            return bool(np.any(np.all(point >= self._goals_ll, axis=1) &
+                               np.all(point <= self._goals_ur, axis=1)))
         for g in self._goals:
             if g.point_in(point):
                 return True
@@ -127,7 +183,21 @@ class EmptySpace(object):
 
 class WallSpace(EmptySpace):
     """A more complex space with rectangular walls that cannot be passed"""
-    def __init__(self, dimensions, goals=[], walls=[]):
+
+    # Number of random points to draw at once when sampling free points, and
+    # the number of empty batches before giving up
+    _sample_batch = 256
+    _max_empty_batches = 1000
+    # The wall grid is only used with at least this many walls; below that
+    # it's cheaper to check all of the walls' bounding boxes at once. The
+    # numba checks walk the grid themselves, so it pays off much sooner than
+    # for the NumPy checks, which also skip it for paths covering more than
+    # _grid_max_cells cells
+    _grid_min_walls_numba = 200
+    _grid_min_walls = 3000
+    _grid_max_cells = 16
+
+    def __init__(self, dimensions, goals=[], walls=[], cell_size=None):
         """Initialize a WallSpace object
 
         Inherits from EmptySpace without change:
@@ -141,10 +211,56 @@ class WallSpace(EmptySpace):
             dimensions (np.array): The (x, y) dimensions of the space
             goals ([rrt.GoalBase]): A list of goals within the space
             walls ([[ll, ur]]): A list of upper-left & lower-right wall pairs
+            cell_size (float): The size of the grid cells used to find walls
+                               near a path (defaults to 1/16 of the smallest
+                               dimension; around the RRT step size is best)
         """
-        self._dims = dimensions
-        self._goals = goals
+        EmptySpace.__init__(self, dimensions, goals)
         self._walls = walls
+        # Wall corners are stored as contiguous (W, 2) arrays so all walls can
+        # be checked at once; the list above is only kept for the walls
+        # property
+        self._wll = np.ascontiguousarray(
+            np.reshape([w[0] for w in walls], (-1, 2)), dtype=np.float64)
+        self._wur = np.ascontiguousarray(
+            np.reshape([w[1] for w in walls], (-1, 2)), dtype=np.float64)
+        # The four borders of each wall as (wall, border, endpoint, xy)
+        wul = np.stack([self._wll[:, 0], self._wur[:, 1]], axis=1)
+        wlr = np.stack([self._wur[:, 0], self._wll[:, 1]], axis=1)
+        self._wall_edges = np.stack([
+            np.stack([self._wll, wul], axis=1),
+            np.stack([self._wll, wlr], axis=1),
+            np.stack([wul, self._wur], axis=1),
+            np.stack([wlr, self._wur], axis=1)
+        ], axis=1)
+        # Broad phase grid: each cell holds the indices of walls touching it
+        if cell_size is None:
+            cell_size = min(dimensions) / 16.
+        self._cell_size = float(cell_size)
+        self._inv_cell_size = 1. / self._cell_size
+        self._ncells = (max(int(np.ceil(self._dimsx / self._cell_size)), 1),
+                        max(int(np.ceil(self._dimsy / self._cell_size)), 1))
+        ncy = self._ncells[1]
+        x0, y0, x1, y1 = self._cell_range(self._wll[:, 0], self._wll[:, 1],
+                                          self._wur[:, 0], self._wur[:, 1])
+        cells = [[] for _ in range(self._ncells[0] * ncy)]
+        for w in range(len(self._wll)):
+            for i in range(x0[w], x1[w] + 1):
+                for j in range(y0[w], y1[w] + 1):
+                    cells[i * ncy + j].append(w)
+        # Stored flat, with the walls in cell c at
+        # cell_walls[cell_start[c]:cell_start[c+1]], so the numba checks can
+        # walk the grid themselves
+        self._cell_start = np.zeros(len(cells) + 1, dtype=np.intp)
+        self._cell_start[1:] = np.cumsum([len(c) for c in cells])
+        self._cell_walls = np.array([w for c in cells for w in c],
+                                    dtype=np.intp)
+        self._wall_cells = np.ascontiguousarray(np.stack([x0, y0], axis=1))
+        self._grid = (self._inv_cell_size, self._ncells[0], ncy,
+                      self._cell_start, self._cell_walls, self._wall_cells)
+        # Buffer of pre-drawn free points for get_random_free_point
+        self._free_buf = np.empty((0, 2))
+        self._free_idx = 0
 
     def _get_walls(self):
         return self._walls
@@ -153,10 +269,15 @@ class WallSpace(EmptySpace):
 
     def _point_in_walls(self, point):
         """Check if a point is inside any of the walls"""
-        for w in self._walls:
-            if point_in_box(w[0], w[1], point):
-                return True
-        return False
+        return bool(np.any(np.all(point >= self._wll, axis=1) &
+                           np.all(point <= self._wur, axis=1)))
+
+    def _points_in_walls(self, points):
+        """Check which of an (N, 2) array of points are inside any wall"""
+        pts = points[:, np.newaxis, :]
+        inside = (np.all(pts >= self._wll, axis=2) &
+                  np.all(pts <= self._wur, axis=2))
+        return np.any(inside, axis=1)
 
     def collision_free(self, point_from, point_to):
         """Determines if there is a collision moving between two points
@@ -171,40 +292,145 @@ class WallSpace(EmptySpace):
             Boolean indicating whether there is a clear linear path between the
             two points
         """
+        if HAS_NUMBA:
+            if len(self._wll) >= self._grid_min_walls_numba:
+                return collision_free_grid_2d(
+                    float(point_from[0]), float(point_from[1]),
+                    float(point_to[0]), float(point_to[1]),
+                    self._dimsx, self._dimsy, self._wll, self._wur,
+                    self._grid)
+            return collision_free_2d(float(point_from[0]),
+                                     float(point_from[1]),
+                                     float(point_to[0]), float(point_to[1]),
+                                     self._dimsx, self._dimsy,
+                                     self._wll, self._wur)
 
         # Check that the points are in bounds
-        if not ((np.all(point_from > 0) and np.all(point_from < self._dims) and
-                np.all(point_to > 0) and np.all(point_to < self._dims))):
+        if not EmptySpace.collision_free(self, point_from, point_to):
             return False
 
-        # Cache some stats for easy use
+        # Only need to check walls that are close enough to the points
+        close = self._walls_near(point_from, point_to)
+        if len(close) == 0:
+            return True
+        wll, wur = self._wll[close], self._wur[close]
+        # Quick check: are either of the points inside?
+        if (np.any(np.all((point_from >= wll) & (point_from <= wur), 1)) or
+                np.any(np.all((point_to >= wll) & (point_to <= wur), 1))):
+            return False
+        # Otherwise, check that the line doesn't intersect borders
+        edges = self._wall_edges[close]
+        return not np.any(np.isfinite(
+            segment_crossings(point_from, point_to,
+                              edges[:, :, 0], edges[:, :, 1])))
+
+    def _cell_range(self, min_x, min_y, max_x, max_y):
+        """Returns the first and last grid cells (x0, y0, x1, y1) of a box
+        (or arrays of them), clipped into the grid"""
+        def cell(v, n):
+            c = np.floor(np.multiply(v, self._inv_cell_size)).astype(np.intp)
+            return np.clip(c, 0, n - 1)
+        nx, ny = self._ncells
+        return (cell(min_x, nx), cell(min_y, ny),
+                cell(max_x, nx), cell(max_y, ny))
+
+    def _grid_walls(self, point_from, point_to):
+        """Returns the indices of walls in grid cells a path's bounding box
+        touches (or None if all walls should just be checked)"""
+        if len(self._wll) < self._grid_min_walls:
+            return None
+        nx, ny = self._ncells
+        inv = self._inv_cell_size
+        x0 = min(max(int(math.floor(min(point_from[0], point_to[0]) * inv)),
+                     0), nx - 1)
+        x1 = min(max(int(math.floor(max(point_from[0], point_to[0]) * inv)),
+                     0), nx - 1)
+        y0 = min(max(int(math.floor(min(point_from[1], point_to[1]) * inv)),
+                     0), ny - 1)
+        y1 = min(max(int(math.floor(max(point_from[1], point_to[1]) * inv)),
+                     0), ny - 1)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self._grid_max_cells:
+            return None
+        # Walls covering more than one cell can come up more than once, which
+        # only repeats a little work
+        starts = self._cell_start
+        found = [self._cell_walls[starts[i * ny + y0]:starts[i * ny + y1 + 1]]
+                 for i in range(x0, x1 + 1)]
+        return found[0] if len(found) == 1 else np.concatenate(found)
+
+    def _walls_near(self, point_from, point_to):
+        """Returns indices of walls overlapping the path's bounding box"""
         min_x = min(point_from[0], point_to[0])
         max_x = max(point_from[0], point_to[0])
         min_y = min(point_from[1], point_to[1])
         max_y = max(point_from[1], point_to[1])
+        cand = self._grid_walls(point_from, point_to)
+        if cand is None:
+            wll, wur = self._wll, self._wur
+        else:
+            wll, wur = self._wll[cand], self._wur[cand]
+        close = ~((min_x > wur[:, 0]) |   # starts to the right of wall
+                  (min_y > wur[:, 1]) |   # starts above the wall
+                  (max_x < wll[:, 0]) |   # ends to the left of the wall
+                  (max_y < wll[:, 1]))    # ends below the wall
+        if cand is None:
+            return np.flatnonzero(close)
+        return cand[close]
+
+    def get_path_cost_batch(self, points_from, points_to):
+        """Determines the costs for traversing between many pairs of points
+
+        Args:
+            points_from (np.array): (K, 2) array of points to move from
+            points_to (np.array): (K, 2) array of points to move to
+
+        Returns:
+            A (K,) array of the distances between the points (inf for any
+            paths that are out of bounds or hit a wall)
+        """
+        if HAS_NUMBA:
+            return path_costs_2d(np.asarray(points_from, dtype=np.float64),
+                                 np.asarray(points_to, dtype=np.float64),
+                                 self._dimsx, self._dimsy,
+                                 self._wll, self._wur, self._grid,
+                                 len(self._wll) >= self._grid_min_walls_numba)
+        costs = EmptySpace.get_path_cost_batch(self, points_from, points_to)
+        if len(self._wll) == 0:
+            return costs
+        # Check every path against every wall: (K, W) for the endpoints and
+        # (K, W, 4) for the borders
+        pf = points_from[:, np.newaxis, :]
+        pt = points_to[:, np.newaxis, :]
+        inside = ((np.all(pf >= self._wll, 2) & np.all(pf <= self._wur, 2)) |
+                  (np.all(pt >= self._wll, 2) & np.all(pt <= self._wur, 2)))
+        crossings = segment_crossings(pf[:, :, np.newaxis, :],
+                                      pt[:, :, np.newaxis, :],
+                                      self._wall_edges[:, :, 0],
+                                      self._wall_edges[:, :, 1])
+        blocked = np.any(inside | np.any(np.isfinite(crossings), 2), 1)
+        costs[blocked] = np.inf
+        return costs
+
+    def get_path_costs_from(self, point_from, points_to):
+        """Determines the costs for traversing from one point to many others
 
-        for w in self._walls:
-            # Only need to check if the points are close enough to the walls
-            if not (min_x > w[1][0] or          # starts to the right of wall
-                    min_y > w[1][1] or          # starts above the wall
-                    max_x < w[0][0] or          # ends to the left of the wall
-                    max_y < w[0][1]):           # ends below the wall
-                # Quick check: are either of the points inside?
-                if (point_in_box(w[0], w[1], point_from) or
-                    point_in_box(w[0], w[1], point_to)):
-                    return False
-                # Otherwise, check that the line doesn't intersect borders
-                ilines = [
-                    [w[0], [w[0][0], w[1][1]]],
-                    [w[0], [w[1][0], w[0][1]]],
-                    [[w[0][0], w[1][1]], w[1]],
-                    [[w[1][0], w[0][1]], w[1]]
-                ]
-                for il in ilines:
-                    if lines_intersect(point_from, point_to,
-                                       il[0], il[1]):
-                        return False
-        return True
+        Args:
+            point_from (np.array): point in the space to move from
+            points_to (np.array): (K, 2) array of points to move to
+
+        Returns:
+            A (K,) array of the path costs (inf for any paths that are out of
+            bounds or hit a wall)
+        """
+        if HAS_NUMBA:
+            return path_costs_from_2d(float(point_from[0]),
+                                      float(point_from[1]),
+                                      np.asarray(points_to, dtype=np.float64),
+                                      self._dimsx, self._dimsy,
+                                      self._wll, self._wur, self._grid,
+                                      len(self._wll) >=
+                                      self._grid_min_walls_numba)
+        return EmptySpace.get_path_costs_from(self, point_from, points_to)
 
     def get_nearest_free_point(self, point_from, point_to):
         """Returns the nearest legal point on a path
@@ -231,47 +457,29 @@ class WallSpace(EmptySpace):
             if intersect:
                 return intersect
 
-        # Cache some stats for easy use
-        min_x = min(point_from[0], point_to[0])
-        max_x = max(point_from[0], point_to[0])
-        min_y = min(point_from[1], point_to[1])
-        max_y = max(point_from[1], point_to[1])
-
-        # Go through each of the walls and find the intersections
-        intersect_points = []
-        for w in self._walls:
-            # Only need to check if the points are close enough to the walls
-            if not (min_x > w[1][0] or          # starts to the right of wall
-                    min_y > w[1][1] or          # starts above the wall
-                    max_x < w[0][0] or          # ends to the left of the wall
-                    max_y < w[0][1]):           # ends below the wall
-                # Find and store the intersection points
-                ilines = [
-                    [w[0], [w[0][0], w[1][1]]],
-                    [w[0], [w[1][0], w[0][1]]],
-                    [[w[0][0], w[1][1]], w[1]],
-                    [[w[1][0], w[0][1]], w[1]]
-                ]
-                for il in ilines:
-                    p = find_intersection_point(point_from, point_to,
-                                                il[0], il[1])
-                    if p is not None:
-                        intersect_points.append(p)
-        # If there are any intersection points, find the nearest to
-        # point_from
-        if len(intersect_points) > 0:
-            # Easy case... only one intersection
-            if len(intersect_points) == 1:
-                return intersect_points[0]
-            # Otherwise, find the point closest to point_from
-            best_point = intersect_points[0]
-            min_dist = np.linalg.norm(point_from - best_point)
-            for ip in intersect_points[1:]:
-                this_dist = np.linalg.norm(point_from - ip)
-                if this_dist < min_dist:
-                    best_point = ip
-                    min_dist = this_dist
-            return best_point
+        # Go through each of the nearby walls and find the intersections
+        if HAS_NUMBA:
+            pfx, pfy = float(point_from[0]), float(point_from[1])
+            ptx, pty = float(point_to[0]), float(point_to[1])
+            if len(self._wll) >= self._grid_min_walls_numba:
+                first = first_wall_crossing_grid_2d(pfx, pfy, ptx, pty,
+                                                    self._wll, self._wur,
+                                                    self._grid)
+            else:
+                first = first_wall_crossing_2d(pfx, pfy, ptx, pty,
+                                               self._wll, self._wur)
+            if np.isfinite(first):
+                return point_from + first * (point_to - point_from)
+            return point_to
+        close = self._walls_near(point_from, point_to)
+        if len(close) > 0:
+            edges = self._wall_edges[close]
+            crossings = segment_crossings(point_from, point_to,
+                                          edges[:, :, 0], edges[:, :, 1])
+            # The first crossing along the path is nearest to point_from
+            first = crossings.min()
+            if np.isfinite(first):
+                return point_from + first * (point_to - point_from)
 
         # If we are here, there is no intersection
         return point_to
@@ -279,13 +487,21 @@ class WallSpace(EmptySpace):
     def get_random_free_point(self):
         """Returns a random in-bound point
 
-        Implemented relatively inefficiently via rejection sampling
+        Implemented via rejection sampling, but points are drawn and checked
+        in batches then handed out one at a time
 
         Returns:
             An (x, y) pair of a random good point
         """
-        pt = np.random.rand(2) * self._dims
-        if self._point_in_walls(pt):
-            return self.get_random_free_point()
-        else:
-            return pt
+        n_tries = 0
+        while self._free_idx >= len(self._free_buf):
+            if n_tries == self._max_empty_batches:
+                raise RuntimeError("Could not sample a point outside of the "
+                                   "walls -- is the space entirely blocked?")
+            pts = np.random.rand(self._sample_batch, 2) * self._dims
+            self._free_buf = pts[~self._points_in_walls(pts)]
+            self._free_idx = 0
+            n_tries += 1
+        pt = self._free_buf[self._free_idx]
+        self._free_idx += 1
+        return pt
@@ -6,55 +6,66 @@ Objects here are mostly for private use but can be exported
 
 from __future__ import division, print_function
 import numpy as np
+from scipy.spatial import cKDTree
 import warnings
+from ._kernels import HAS_NUMBA, nearest_idx, near_idx
 
 __all__ = ['Node', 'DirectedTree']
 
 
 class Node(object):
-    """Represents a node in a DirectedTree"""
-    def __init__(self, pt, parent, add_cost=1):
+    """Represents a node in a DirectedTree
+
+    Attributes:
+        point (np.array): the location of this Node
+        parent (Node): the parent node (None for the head of a tree)
+        children (list): the child nodes
+        cost (float): the total cost of reaching this node from the head
+        index (int): the position of this node in its tree's nodes and
+                     arrays (None if it is not in a tree)
+        is_goal: whether this node touches one of the goal regions (set
+                 through mark_goal)
+    """
+
+    # Trees can hold many thousands of nodes, so skip the per-node __dict__
+    __slots__ = ('point', 'parent', 'children', 'is_goal', '_cost',
+                 '_newcost', '_tree', '_idx', '_child_idx')
+
+    def __init__(self, pt, parent, add_cost=1, tree=None):
         """Initialize the nodes
 
         Args:
             pt (list/np.array): a list of floats for the coordinate of the node
             parent (Node): the parent node
             add_cost (float): additional cost for traversing this node
+            tree (DirectedTree): the tree this node belongs to (if any)
         """
-        self._pt = np.array(pt)
-        self._parent = parent
-        self._children = []
+        # Nodes in a tree get a view into the tree's point array when stored,
+        # so the point is only copied once
+        self.point = np.array(pt) if tree is None else pt
+        self._tree = tree
+        self._idx = None  # Position in the tree's point & cost arrays
+        self.parent = parent
+        self.children = []
+        self._child_idx = None  # Position in the parent's list of children
         self._newcost = add_cost
-        if self._parent is None:
+        # Once in a tree, the cost is kept in the tree's cost array instead
+        if parent is None:
             self._cost = 0
         else:
             self._cost = parent.cost + add_cost
-        self._goal = False  # Marks whether this node is on a goal
-
-    def _get_children(self):
-        return self._children
-    children = property(_get_children)
-    """Returns a list of child nodes"""
-
-    def _get_parent(self):
-        return self._parent
-    parent = property(_get_parent)
-    """Returns the parent node"""
-
-    def _get_point(self):
-        return self._pt
-    point = property(_get_point)
-    """Returns the location of this Node"""
+        self.is_goal = False  # Marks whether this node is on a goal
 
     def _get_cost(self):
-        return self._cost
+        if self._idx is None:
+            return self._cost
+        return self._tree._costs[self._idx]
     cost = property(_get_cost)
-    """Returns the total cost of this node (with all children included)"""
 
-    def _is_goal(self):
-        return self._goal
-    is_goal = property(_is_goal)
-    """Exposes whether this is a goal node"""
+    def _get_index(self):
+        return self._idx
+    index = property(_get_index)
+    """The position of this node in its tree's nodes and arrays (read-only)"""
 
     def add_child(self, child_node):
         """Appends a child node
@@ -62,7 +73,8 @@ class Node(object):
         Args:
             child_node (Node): the child to add
         """
-        self._children.append(child_node)
+        child_node._child_idx = len(self.children)
+        self.children.append(child_node)
 
     def distance(self, newpt):
         """Returns the distance from this nodes point to another
@@ -70,22 +82,45 @@ class Node(object):
         Args:
             newpt (np.array): a vector with the same dimensions as pt
         """
-        return np.linalg.norm(self._pt - newpt)
+        return np.sqrt(self.distance_sq(newpt))
+
+    def distance_sq(self, newpt):
+        """Returns the squared distance from this nodes point to another
+
+        Cheaper than distance, for when distances only need to be compared
+
+        Args:
+            newpt (np.array): a vector with the same dimensions as pt
+        """
+        d = self.point - newpt
+        return d.dot(d)
 
     def get_terminals(self):
         """Returns a list of terminal nodes that descend from this node"""
-        r = []
-        for c in self._children:
-            r = r + c.get_terminals()
-        return r
+        terms = []
+        stack = [self]
+        while len(stack) > 0:
+            n = stack.pop()
+            if len(n.children) == 0:
+                terms.append(n)
+            else:
+                stack.extend(n.children)
+        return terms
     terminals = property(get_terminals)
     """Returns a list of terminal nodes that descend from this node"""
 
     def recost(self):
         """Recalculates travel costs of this and child nodes"""
-        self._cost = self._parent._cost + self._newcost
-        for c in self._children:
-            c.recost()
+        if self._idx is not None:
+            self._tree._recost(self)
+            return
+        # Walk the subtree with a stack rather than recursing, since deep
+        # trees are common and each level of recursion is a Python call
+        stack = [self]
+        while len(stack) > 0:
+            n = stack.pop()
+            n._cost = n.parent.cost + n._newcost
+            stack.extend(n.children)
 
     def reparent(self, newparent, newcost=1):
         """Makes a new parent connection and recalculates costs
@@ -94,10 +129,18 @@ class Node(object):
             newparent (Node): the new parent node
             newcost (float): the new cost of traversal
         """
-        self._parent._children.remove(self)
-        self._parent = newparent
-        newparent._children.append(self)
+        # Swap the last sibling into this node's place so removal is O(1)
+        siblings = self.parent.children
+        last = siblings.pop()
+        if last is not self:
+            siblings[self._child_idx] = last
+            last._child_idx = self._child_idx
+        self.parent = newparent
+        newparent.add_child(self)
         self._newcost = newcost
+        if self._tree is not None:
+            self._tree._terminals = None
+            self._tree._parents[self._idx] = newparent._idx
         self.recost()
 
     def mark_goal(self, goal=True):
@@ -106,21 +149,193 @@ class Node(object):
         Args:
             goal: A way of marking particular goals (defaults to True)
         """
-        self._goal = goal
+        old_goal = self.is_goal
+        self.is_goal = goal
+        if self._tree is not None:
+            self._tree._goal_changed(self, old_goal)
+
+
+def _insert_by_index(nodes, node):
+    """Inserts a node into a list of nodes kept in order of node index"""
+    lo, hi = len(nodes), len(nodes)
+    # Nodes are usually marked just after being added, so check the end first
+    if hi > 0 and nodes[-1]._idx > node._idx:
+        lo = 0
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if nodes[mid]._idx < node._idx:
+                lo = mid + 1
+            else:
+                hi = mid
+    nodes.insert(lo, node)
+
+
+class _KDIndex(object):
+    """Spatial index over node points that is rebuilt lazily as nodes are added
+
+    A cKDTree is built over the indexed points, and points added after that
+    are kept in a tail that is searched directly. The cKDTree is rebuilt once
+    the tail grows past sqrt(n), trading off the O(n log n) rebuild against
+    the O(n) scans of the tail. Points are referred to by their node index in
+    the DirectedTree, and queries take the tree's point array and free mask
+    """
+
+    # Never rebuild for a tail shorter than this -- a vectorized scan over a
+    # few hundred points is quicker than a cKDTree query from Python
+    _min_tail = 128
+
+    __slots__ = ('_kd', '_kd_idx', '_tail', '_indexed')
+
+    def __init__(self):
+        self._kd = None
+        self._kd_idx = np.empty(0, dtype=np.intp)
+        self._tail = []
+        self._indexed = np.zeros(16, dtype=bool)  # Which node indices are in
+
+    def insert(self, idx):
+        """Adds a node index to the index
+
+        Args:
+            idx (int): the index of the node to add
+        """
+        while idx >= len(self._indexed):
+            self._indexed = np.concatenate([self._indexed,
+                                            np.zeros(len(self._indexed),
+                                                     dtype=bool)])
+        self._indexed[idx] = True
+        self._tail.append(idx)
+
+    def contains(self, idx):
+        """Returns whether a node index is currently in the index
+
+        Args:
+            idx (int): the index of the node to check
+        """
+        return idx < len(self._indexed) and bool(self._indexed[idx])
+
+    def _refresh(self, points, free):
+        """Rebuilds the cKDTree if the tail has grown too long, and returns
+        the node indices in the tail (which may include goals)"""
+        tail = np.array(self._tail, dtype=np.intp)
+        n = len(self._kd_idx) + len(tail)
+        if len(tail) > max(self._min_tail, np.sqrt(n)):
+            # Drop anything marked as a goal since it was indexed
+            idx = np.concatenate([self._kd_idx, tail])
+            self._indexed[idx[~free[idx]]] = False
+            self._kd_idx = idx[free[idx]]
+            self._kd = cKDTree(points[self._kd_idx])
+            self._tail = []
+            return np.empty(0, dtype=np.intp)
+        return tail
+
+    def nearest(self, newpt, points, free):
+        """Returns the index of the nearest free point (or None)
+
+        Args:
+            newpt (np.array): the point to find the closest node to
+            points (np.array): the (N, d) array of node points
+            free (np.array): boolean mask of which node indices are free
+        """
+        tail = self._refresh(points, free)
+        best = None
+        best_dist = np.inf
+        if self._kd is not None:
+            dist, i = self._kd.query(newpt)
+            if not free[self._kd_idx[i]]:
+                # Marked as a goal after indexing -- find the closest free one
+                dists, js = self._kd.query(newpt, k=len(self._kd_idx))
+                dists, js = np.atleast_1d(dists), np.atleast_1d(js)
+                is_free = free[self._kd_idx[js]]
+                first = np.argmax(is_free)
+                dist, i = dists[first], js[first]
+                if not is_free[first]:
+                    dist = np.inf
+            if dist < best_dist:
+                best_dist = dist
+                best = self._kd_idx[i]
+        if len(tail) > 0:
+            if HAS_NUMBA:
+                i, dist2 = nearest_idx(points, tail, free,
+                                       np.asarray(newpt, dtype=np.float64))
+            else:
+                tail = tail[free[tail]]
+                i, dist2 = -1, np.inf
+                if len(tail) > 0:
+                    diff = points[tail] - newpt
+                    dists2 = np.einsum('ij,ij->i', diff, diff)
+                    k = np.argmin(dists2)
+                    i, dist2 = tail[k], dists2[k]
+            if i >= 0 and dist2 < best_dist * best_dist:
+                best = i
+        return best
+
+    def near(self, newpt, radius, points, free):
+        """Returns the indices of all free points within radius of a point
+
+        Args:
+            newpt (np.array): the point to search around
+            radius (float): the maximum distance away to include points
+            points (np.array): the (N, d) array of node points
+            free (np.array): boolean mask of which node indices are free
+        """
+        tail = self._refresh(points, free)
+        r2 = radius * radius
+        found = np.empty(0, dtype=np.intp)
+        if self._kd is not None:
+            found = self._kd_idx[self._kd.query_ball_point(newpt, radius)]
+            found = found[free[found]]
+        if len(tail) > 0:
+            if HAS_NUMBA:
+                in_tail = near_idx(points, tail, free,
+                                   np.asarray(newpt, dtype=np.float64), r2)
+            else:
+                tail = tail[free[tail]]
+                diff = points[tail] - newpt
+                dists2 = np.einsum('ij,ij->i', diff, diff)
+                in_tail = tail[dists2 <= r2]
+            found = np.concatenate([found, in_tail])
+        return found
 
 
 class DirectedTree(object):
     """A directed tree that can be reshaped (for RRT*)"""
 
+    __slots__ = ('_head', '_nodes', '_points', '_costs', '_free', '_parents',
+                 '_pt_index', '_free_nodes', '_goal_nodes', '_best_goal',
+                 '_best_goal_cost', '_best_goal_stale', '_index',
+                 '_n_indexed', '_terminals')
+
     def __init__(self, init_pt):
         """Initializes the DirectedTree
 
         Args:
             init_pt (list/np.array): the starting location of the tree
         """
-        headnode = Node(init_pt, None)
+        # Node points, costs, and whether they are free, kept in arrays by
+        # node index (grown by doubling) for vectorized lookups
+        self._points = np.empty((16, len(init_pt)))
+        self._costs = np.empty(16)
+        self._free = np.empty(16, dtype=bool)
+        self._parents = np.empty(16, dtype=np.intp)
+        self._nodes = []
+        self._pt_index = {}  # Maps the bytes of each point to its node
+        # Free and goal nodes, kept up to date by _store and _goal_changed
+        # (the properties hand out copies so callers can't break them)
+        self._free_nodes = []
+        self._goal_nodes = []
+        headnode = Node(init_pt, None, tree=self)
         self._head = headnode
-        self._nodes = [headnode]
+        self._store(headnode)
+        # Running minimum over the goal nodes (recomputed only if it goes
+        # stale from the best goal getting more expensive or unmarked)
+        self._best_goal = None
+        self._best_goal_cost = np.inf
+        self._best_goal_stale = False
+        # Nodes are indexed lazily so that goal nodes (which are marked right
+        # after being added) never make it into the spatial index
+        self._index = _KDIndex()
+        self._n_indexed = 0
+        self._terminals = None  # Cached until the tree changes shape
 
     def _get_head(self):
         return self._head
@@ -143,12 +358,110 @@ class DirectedTree(object):
         Returns:
             The Node object added to the tree
         """
-        assert parent in self._nodes, "parent not found in this tree"
-        child = Node(childpt, parent, add_cost)
+        assert self._contains(parent), "parent not found in this tree"
+        child = Node(childpt, parent, add_cost, self)
         parent.add_child(child)
-        self._nodes.append(child)
+        self._store(child)
+        self._terminals = None
         return child
 
+    def _store(self, node):
+        """Appends a new node to the node list and arrays"""
+        n = len(self._nodes)
+        if n == len(self._costs):
+            self._points = np.concatenate([self._points,
+                                           np.empty(self._points.shape)])
+            self._costs = np.concatenate([self._costs, np.empty(n)])
+            self._free = np.concatenate([self._free, np.empty(n, bool)])
+            self._parents = np.concatenate([self._parents,
+                                            np.empty(n, np.intp)])
+        node._idx = n
+        self._nodes.append(node)
+        # Points never move, so the node's view stays correct even after the
+        # array is grown (it just keeps the old block alive)
+        self._points[n] = node.point
+        node.point = self._points[n]
+        # Keep the first node at a point if any are repeated
+        self._pt_index.setdefault(node.point.tobytes(), node)
+        self._costs[n] = node._cost
+        self._free[n] = node.is_goal is False
+        self._parents[n] = -1 if node.parent is None else node.parent._idx
+        if node.is_goal is False:
+            self._free_nodes.append(node)
+        elif node.is_goal is True:
+            self._goal_nodes.append(node)
+
+    def _sync_node(self, node):
+        """Updates the free mask and best goal after a node's goal changes
+
+        Args:
+            node (Node): the node that has changed
+        """
+        self._free[node._idx] = node.is_goal is False
+        if node.is_goal is True or node is self._best_goal:
+            self._update_best_goal(node)
+
+    def _recost(self, node):
+        """Updates the costs of a node and its subtree after its edge changes
+
+        Every node in the subtree changes cost by the same amount, so the
+        subtree's indices are gathered and shifted with one array add
+
+        Args:
+            node (Node): the node whose parent or edge cost has changed
+        """
+        new_cost = node.parent.cost + node._newcost
+        old_cost = node.cost
+        idx = []
+        goals = []
+        stack = [node]
+        while len(stack) > 0:
+            n = stack.pop()
+            idx.append(n._idx)
+            if n.is_goal is True or n is self._best_goal:
+                goals.append(n)
+            stack.extend(n.children)
+        if np.isfinite(new_cost) and np.isfinite(old_cost):
+            self._costs[idx] += new_cost - old_cost
+        else:
+            # Coming from or going to an inf cost, so there's nothing to
+            # shift by -- recompute in order instead (parents come first)
+            for i in idx:
+                n = self._nodes[i]
+                self._costs[i] = n.parent.cost + n._newcost
+        for n in goals:
+            self._update_best_goal(n)
+
+    def _contains(self, node):
+        """Checks whether a node belongs to this tree, using its index"""
+        idx = getattr(node, '_idx', None)
+        return (idx is not None and idx < len(self._nodes) and
+                self._nodes[idx] is node)
+
+    def _goal_changed(self, node, old_goal):
+        """Moves a node between the free and goal lists after it is marked
+
+        Args:
+            node (Node): the node that has been marked
+            old_goal: the node's goal marking before it changed
+        """
+        for nodes, flag in ((self._free_nodes, False),
+                            (self._goal_nodes, True)):
+            if old_goal is flag and node.is_goal is not flag:
+                # Nodes are usually marked just after being added
+                if nodes[-1] is node:
+                    nodes.pop()
+                else:
+                    nodes.remove(node)
+            elif old_goal is not flag and node.is_goal is flag:
+                _insert_by_index(nodes, node)
+        self._sync_node(node)
+        # A node that was a goal when the index caught up (or was dropped
+        # from it since) has to be put back in once it is free again
+        if (node.is_goal is False and node._idx < self._n_indexed and
+                not self._index.contains(node._idx)):
+            self._index.insert(node._idx)
+
     def get_node(self, position):
         """Locates a node by its position
 
@@ -158,23 +471,57 @@ class DirectedTree(object):
         Returns:
             The Node at that position (or a warning and None if not found)
         """
-        for n in self._nodes:
-            if np.all(n.pt == np.array(position)):
-                return n
+        pos = np.asarray(position, dtype=self._points.dtype)
+        node = self._pt_index.get(pos.tobytes())
+        if node is not None:
+            return node
         warnings.warn('Node with that position not found: ' + str(position),
                       RuntimeWarning)
         return None
 
     def _get_free_nodes(self):
-        return [n for n in self._nodes if n.is_goal is False]
+        return list(self._free_nodes)
     free_nodes = property(_get_free_nodes)
     """Returns only the nodes that are not touching a goal region"""
 
     def _get_goal_nodes(self):
-        return [n for n in self._nodes if n.is_goal is True]
+        return list(self._goal_nodes)
     goal_nodes = property(_get_goal_nodes)
     """Returns only the nodes that are touching a goal region"""
 
+    def _update_index(self):
+        """Adds any free nodes created since the last query to the index"""
+        for i in range(self._n_indexed, len(self._nodes)):
+            if self._free[i]:
+                self._index.insert(i)
+        self._n_indexed = len(self._nodes)
+
+    def _update_best_goal(self, node):
+        """Updates the cheapest goal node after a node's cost or goal changes
+
+        Args:
+            node (Node): the node that has changed
+        """
+        if node is self._best_goal:
+            if node.is_goal is True and node.cost <= self._best_goal_cost:
+                self._best_goal_cost = node.cost
+            else:
+                self._best_goal_stale = True
+        elif node.is_goal is True and node.cost < self._best_goal_cost:
+            self._best_goal = node
+            self._best_goal_cost = node.cost
+
+    def _get_best_goal(self):
+        if self._best_goal_stale:
+            self._best_goal = None
+            self._best_goal_cost = np.inf
+            self._best_goal_stale = False
+            for n in self._goal_nodes:
+                self._update_best_goal(n)
+        return self._best_goal
+    best_goal = property(_get_best_goal)
+    """Returns the goal node with the lowest cost (or None if no goals)"""
+
     def nearest(self, newpt):
         """Returns the nearest Node to a given point
 
@@ -184,9 +531,9 @@ class DirectedTree(object):
         Returns:
             A Node from the tree closest to that point
         """
-        frees = self.free_nodes
-        dists = np.array(list(map(lambda n: n.distance(newpt), frees)))
-        return frees[np.argmin(dists)]
+        self._update_index()
+        idx = self._index.nearest(newpt, self._points, self._free)
+        return None if idx is None else self._nodes[idx]
 
     def near(self, newpt, radius):
         """Returns all nodes within a given distance of a point
@@ -198,13 +545,21 @@ class DirectedTree(object):
         Returns:
             A list of Nodes within radius of newpt
         """
-        frees = self.free_nodes
-        dists = list(map(lambda n: n.distance(newpt) <= radius, frees))
-        rets = []
-        for i in range(len(dists)):
-            if dists[i]:
-                rets.append(frees[i])
-        return rets
+        return [self._nodes[i] for i in self.near_indices(newpt, radius)]
+
+    def near_indices(self, newpt, radius):
+        """Like near, but returns node indices for use with the tree arrays
+
+        Args:
+            newpt (np.array): the point to find the closest node to
+            radius (float): the maximum distance away to include nodes
+
+        Returns:
+            An array of indices (into nodes, point_array, and cost_array) of
+            the Nodes within radius of newpt
+        """
+        self._update_index()
+        return self._index.near(newpt, radius, self._points, self._free)
 
     def path_down(self, end_node):
         """Finds the path from the head down to a given node
@@ -215,17 +570,19 @@ class DirectedTree(object):
         Returns:
             A list of Nodes tracing a path through the tree
         """
-        assert end_node in self._nodes, "end_node not found in this tree"
+        assert self._contains(end_node), "end_node not found in this tree"
         revpath = [end_node]
-        curnode = end_node
-        while curnode.parent is not None:
-            revpath.append(curnode.parent)
+        curnode = end_node.parent
+        while curnode is not None:
+            revpath.append(curnode)
             curnode = curnode.parent
         revpath.reverse()
         return revpath
 
     def _get_terminals(self):
-        return self._head.get_terminals()
+        if self._terminals is None:
+            self._terminals = self._head.get_terminals()
+        return list(self._terminals)
     terminals = property(_get_terminals)
     """Returns all of the terminal nodes of the tree"""
 
@@ -234,6 +591,22 @@ class DirectedTree(object):
     """The number of Nodes in the tree"""
 
     def _get_all_points(self):
-        return [np.array(n._pt) for n in self._nodes]
+        return [np.array(n.point) for n in self._nodes]
     all_points = property(_get_all_points)
     """Returns all positions of nodes in the tree"""
+
+    def _get_point_array(self):
+        return self._points[:len(self._nodes)]
+    point_array = property(_get_point_array)
+    """Returns an (N, d) array of node positions, indexed like nodes"""
+
+    def _get_cost_array(self):
+        return self._costs[:len(self._nodes)]
+    cost_array = property(_get_cost_array)
+    """Returns an (N,) array of node costs, indexed like nodes"""
+
+    def _get_parent_array(self):
+        return self._parents[:len(self._nodes)]
+    parent_array = property(_get_parent_array)
+    """Returns an (N,) array of the index of each node's parent (-1 for the
+    head), indexed like nodes"""
@@ -3,6 +3,7 @@
 """
 
 from ..space import EmptySpace, WallSpace
+import numpy as np
 import pygame as pg
 
 
@@ -10,6 +11,11 @@ def intify(vect):
     return list(map(int, vect))
 
 
+def _screen_points(space, points):
+    """Inverts an (N, 2) array of points at once into lists of screen ints"""
+    return space.invert(points).astype(np.int32).tolist()
+
+
 """Helper functions to draw the space and tree"""
 
 
@@ -34,22 +40,40 @@ def draw_space(surface, space, goal_color=pg.Color('green'),
                          pg.Rect(space.invert(ul), wh))
 
 
-def _draw_down_tree(surface, node, space, node_color=pg.Color('darkgrey'),
-                    path_color=pg.Color('lightgrey')):
-    pt = intify(space.invert(node.point))
-    pg.draw.circle(surface, node_color, pt, 3)
-    for c in node.children:
-        pg.draw.line(surface, path_color,
-                     pt, intify(space.invert(c.point)))
-        _draw_down_tree(surface, c, space)
+def _draw_edges(surface, tree, space, children, node_color, path_color):
+    """Draws the edges up to the given nodes (by index), and the nodes"""
+    parents = tree.parent_array[children]
+    edges = np.flatnonzero(parents >= 0)
+    # Points are inverted all at once, then looked up by index for each edge
+    pts = _screen_points(space, tree.point_array[children])
+    parent_pts = _screen_points(space, tree.point_array[parents[edges]])
+    for i, ppt in zip(edges.tolist(), parent_pts):
+        pg.draw.line(surface, path_color, ppt, pts[i])
+    # Parents not otherwise drawn are redrawn to stay on top of their edges
+    others = np.setdiff1d(parents[edges], children)
+    for pt in pts + _screen_points(space, tree.point_array[others]):
+        pg.draw.circle(surface, node_color, pt, 3)
 
 
 def draw_tree(surface, tree, space, node_color=pg.Color('darkgrey'),
               path_color=pg.Color('lightgrey'),
               start_color=pg.Color('blue')):
-    pg.draw.circle(surface, start_color,
-                   intify(space.invert(tree.head.point)), 5)
-    _draw_down_tree(surface, tree.head, space, node_color, path_color)
+    pts = _screen_points(space, tree.point_array)
+    pg.draw.circle(surface, start_color, pts[tree.head.index], 5)
+    # Split the tree into chains where each node has a single child, so each
+    # chain can be drawn with one call
+    stack = [tree.head]
+    while len(stack) > 0:
+        n = stack.pop()
+        for c in n.children:
+            chain = [pts[n.index], pts[c.index]]
+            while len(c.children) == 1:
+                c = c.children[0]
+                chain.append(pts[c.index])
+            pg.draw.lines(surface, path_color, False, chain)
+            stack.append(c)
+    for pt in pts:
+        pg.draw.circle(surface, node_color, pt, 3)
 
 
 def draw_rrt(surface, rrt, goal_color=pg.Color('green'),
@@ -60,26 +84,60 @@ def draw_rrt(surface, rrt, goal_color=pg.Color('green'),
               node_color, path_color, start_color)
     _, shortest = rrt.get_shortest_path()
     if shortest is not None:
-        pt_path = [intify(rrt.space.invert(p)) for p in shortest]
+        pt_path = _screen_points(rrt.space, np.array(shortest))
         pg.draw.lines(surface, start_color, False, pt_path, 2)
 
 
 def animate_rrt(surface, rrt, steps=1000, goal_color=pg.Color('green'),
              wall_color=pg.Color('black'), node_color=pg.Color('darkgrey'),
-             path_color=pg.Color('lightgrey'), start_color=pg.Color('blue')):
-    draw_space(surface, rrt.space, goal_color, wall_color)
-    draw_tree(surface, rrt.tree, rrt.space,
+             path_color=pg.Color('lightgrey'), start_color=pg.Color('blue'),
+             redraw_every=50):
+    """Runs an RRT for a number of steps, drawing the tree as it grows
+
+    Each frame only draws the edges that changed. When RRT* rewires a node
+    its new edge is drawn straight away, but the old edge can't be erased
+    without redrawing everything, so it stays on screen until the whole tree
+    is redrawn -- at most redraw_every frames after the first rewire, and at
+    the end of the animation
+    """
+    tree = rrt.tree
+    # The space never changes, so it is drawn once onto a background. The
+    # tree is kept drawn over that on its own surface
+    space_surface = surface.copy()
+    draw_space(space_surface, rrt.space, goal_color, wall_color)
+    tree_surface = space_surface.copy()
+    draw_tree(tree_surface, tree, rrt.space,
               node_color, path_color, start_color)
+    drawn_parents = tree.parent_array.copy()
+    surface.blit(tree_surface, (0, 0))
     pg.display.flip()
-    for _ in range(steps):
+    since_rewire = None  # Frames that old edges have been left on screen
+    for step in range(steps):
         pg.event.pump()
         rrt.step()
-        draw_space(surface, rrt.space, goal_color, wall_color)
-        draw_tree(surface, rrt.tree, rrt.space,
-                  node_color, path_color, start_color)
+        parents = tree.parent_array
+        n_drawn = len(drawn_parents)
+        rewired = np.flatnonzero(parents[:n_drawn] != drawn_parents)
+        if len(rewired) > 0 and since_rewire is None:
+            since_rewire = 0
+        if since_rewire is not None and (since_rewire >= redraw_every or
+                                         step == steps - 1):
+            tree_surface.blit(space_surface, (0, 0))
+            draw_tree(tree_surface, tree, rrt.space,
+                      node_color, path_color, start_color)
+            since_rewire = None
+        else:
+            changed = np.concatenate([rewired,
+                                      np.arange(n_drawn, tree.n_vertices)])
+            _draw_edges(tree_surface, tree, rrt.space, changed,
+                        node_color, path_color)
+            if since_rewire is not None:
+                since_rewire += 1
+        drawn_parents = parents.copy()
+        surface.blit(tree_surface, (0, 0))
         _, shortest = rrt.get_shortest_path()
         if shortest is not None:
-            pt_path = [intify(rrt.space.invert(p)) for p in shortest]
+            pt_path = _screen_points(rrt.space, np.array(shortest))
             pg.draw.lines(surface, start_color, False, pt_path, 2)
         pg.display.flip()
     pause_pg()
@@ -10,5 +10,5 @@ setup(name = "rrt",
       author_email= "k2smith@mit.edu",
       url = "https://github.com/kasmith/rrt",
       packages = ["rrt", "rrt.viz", "rrt.interface"],
-      requires = ["numpy", "pygame", "geometry"],
-      suggests = ["phystables"])
+      requires = ["numpy", "scipy", "pygame", "geometry"],
+      suggests = ["phystables", "numba"])
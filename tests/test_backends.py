@@ -0,0 +1,158 @@
+"""Checks that the numba and NumPy code paths (and the spatial index) agree
+
+The numba kernels are only used if numba is installed, so each check runs the
+same queries with HAS_NUMBA switched on and off and compares the answers
+
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+import rrt.space
+import rrt.tree
+from rrt import WallSpace
+from rrt.tree import DirectedTree
+
+DIMS = np.array([500., 500.])
+N_WALLS = 40
+
+
+@pytest.fixture(scope='module')
+def space():
+    rs = np.random.RandomState(0)
+    ll = rs.rand(N_WALLS, 2) * 470
+    walls = [[l, l + rs.rand(2) * 25 + 2] for l in ll]
+    return WallSpace(DIMS, [], walls)
+
+
+@pytest.fixture(scope='module')
+def segments():
+    rs = np.random.RandomState(1)
+    starts = rs.rand(2000, 2) * DIMS
+    angles = rs.rand(2000) * 2 * np.pi
+    lengths = rs.rand(2000) * 60
+    ends = starts + lengths[:, np.newaxis] * np.stack([np.cos(angles),
+                                                       np.sin(angles)], 1)
+    return starts, ends
+
+
+def _in_bounds(starts, ends):
+    ok = (np.all((starts > 0) & (starts < DIMS), 1) &
+          np.all((ends > 0) & (ends < DIMS), 1))
+    return starts[ok], ends[ok]
+
+
+def _both(monkeypatch, module, f):
+    """Returns f() with numba used, then with only NumPy"""
+    monkeypatch.setattr(module, 'HAS_NUMBA', True)
+    with_numba = f()
+    monkeypatch.setattr(module, 'HAS_NUMBA', False)
+    without_numba = f()
+    return with_numba, without_numba
+
+
+def _set_grid(monkeypatch, space, use_grid):
+    """Forces the wall grid on or off, whatever the number of walls"""
+    min_walls = 0 if use_grid else 10 ** 9
+    monkeypatch.setattr(space, '_grid_min_walls_numba', min_walls)
+    monkeypatch.setattr(space, '_grid_min_walls', min_walls)
+
+
+@pytest.mark.parametrize('use_grid', [False, True])
+def test_collision_free(monkeypatch, space, segments, use_grid):
+    _set_grid(monkeypatch, space, use_grid)
+    starts, ends = segments
+    with_numba, without_numba = _both(monkeypatch, rrt.space, lambda: [
+        space.collision_free(p, q) for p, q in zip(starts, ends)])
+    assert with_numba == without_numba
+    # Make sure both outcomes actually come up
+    assert 0 < sum(with_numba) < len(with_numba)
+
+
+@pytest.mark.parametrize('use_grid', [False, True])
+def test_get_nearest_free_point(monkeypatch, space, segments, use_grid):
+    _set_grid(monkeypatch, space, use_grid)
+    starts, ends = _in_bounds(*segments)
+    with_numba, without_numba = _both(monkeypatch, rrt.space, lambda: [
+        space.get_nearest_free_point(p, q) for p, q in zip(starts, ends)])
+    np.testing.assert_allclose(with_numba, without_numba)
+
+
+@pytest.mark.parametrize('use_grid', [False, True])
+def test_get_path_cost_batch(monkeypatch, space, segments, use_grid):
+    _set_grid(monkeypatch, space, use_grid)
+    starts, ends = segments
+    with_numba, without_numba = _both(
+        monkeypatch, rrt.space,
+        lambda: space.get_path_cost_batch(starts, ends))
+    np.testing.assert_allclose(with_numba, without_numba)
+    assert np.any(np.isinf(with_numba)) and np.any(np.isfinite(with_numba))
+
+
+@pytest.mark.parametrize('use_grid', [False, True])
+def test_get_path_costs_from(monkeypatch, space, segments, use_grid):
+    _set_grid(monkeypatch, space, use_grid)
+    starts, ends = segments
+    for start in starts[:20]:
+        with_numba, without_numba = _both(
+            monkeypatch, rrt.space,
+            lambda: space.get_path_costs_from(start, ends))
+        np.testing.assert_allclose(with_numba, without_numba)
+
+
+def _brute_nearest(tree, point):
+    free = [n for n in tree.nodes if n.is_goal is False]
+    return min(free, key=lambda n: n.distance(point))
+
+
+def _brute_near(tree, point, radius):
+    return sorted(n.index for n in tree.nodes
+                  if n.is_goal is False and n.distance(point) <= radius)
+
+
+def _check_queries(tree, queries, radius):
+    for q in queries:
+        assert tree.nearest(q) is _brute_nearest(tree, q)
+        assert sorted(tree.near_indices(q, radius)) == _brute_near(tree, q,
+                                                                   radius)
+
+
+@pytest.mark.parametrize('use_numba', [False, True])
+def test_tree_queries(monkeypatch, use_numba):
+    monkeypatch.setattr(rrt.tree, 'HAS_NUMBA', use_numba)
+    rs = np.random.RandomState(2)
+    queries = rs.rand(30, 2) * DIMS
+    tree = DirectedTree(DIMS / 2)
+    nodes = [tree.head]
+    for _ in range(600):
+        parent = nodes[rs.randint(len(nodes))]
+        nodes.append(tree.add_node(parent, rs.rand(2) * DIMS))
+        # Query as the tree grows, so the index is rebuilt along the way
+        if len(nodes) % 50 == 0:
+            _check_queries(tree, queries[:3], 40.)
+    assert tree._index._kd is not None
+    _check_queries(tree, queries, 40.)
+
+    # Goals marked after being indexed have to be skipped
+    goals = [nodes[i] for i in rs.choice(len(nodes), 100, replace=False)]
+    for n in goals:
+        n.mark_goal()
+    _check_queries(tree, queries, 40.)
+    _check_queries(tree, [n.point for n in goals[:10]], 40.)
+
+    # Goals added between queries never go in the index
+    for _ in range(200):
+        n = tree.add_node(nodes[rs.randint(len(nodes))], rs.rand(2) * DIMS)
+        if rs.rand() < .3:
+            n.mark_goal()
+            goals.append(n)
+    _check_queries(tree, queries, 40.)
+
+    # And unmarked goals have to be found again
+    for n in goals[::2]:
+        n.mark_goal(False)
+    _check_queries(tree, queries, 40.)
+    _check_queries(tree, [n.point for n in goals[::2][:10]], 40.)
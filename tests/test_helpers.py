@@ -0,0 +1,23 @@
+"""Checks the geometry helpers"""
+
+from __future__ import division, print_function
+import numpy as np
+import pytest
+
+from rrt.helpers import ball_intersect
+
+WALL = [np.array([10., 20.]), np.array([30., 40.])]
+
+
+@pytest.mark.parametrize('center, radius, touches', [
+    ((5., 30.), 5., True),        # Touches the left edge
+    ((20., 45.), 5., True),       # Touches the bottom edge
+    ((35., 30.), 4.9, False),     # Just short of the right edge
+    ((7., 16.), 5., True),        # Touches the corner (3-4-5 triangle)
+    ((7., 16.), 4.99, False),     # Just short of the corner
+    ((5., 45.), 7., False),       # In reach of both edges but not the corner
+    ((20., 30.), .1, True),       # Inside the wall
+    ((20., 30.), 0., True),
+])
+def test_ball_intersect(center, radius, touches):
+    assert ball_intersect(center, radius, WALL) == touches
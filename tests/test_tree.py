@@ -0,0 +1,153 @@
+"""Checks the bookkeeping DirectedTree keeps alongside its nodes"""
+
+from __future__ import division, print_function
+import numpy as np
+import pytest
+
+from rrt.tree import DirectedTree
+
+
+def _random_tree(n_nodes, seed=0):
+    rs = np.random.RandomState(seed)
+    tree = DirectedTree(np.array([.5, .5]))
+    nodes = [tree.head]
+    for _ in range(n_nodes):
+        nodes.append(tree.add_node(nodes[rs.randint(len(nodes))],
+                                   rs.rand(2), rs.rand()))
+    return tree, nodes, rs
+
+
+def _subtree(node):
+    found = []
+    stack = [node]
+    while len(stack) > 0:
+        n = stack.pop()
+        found.append(n)
+        stack.extend(n.children)
+    return found
+
+
+def _check_costs(tree):
+    """Checks the costs and best goal against a walk over the nodes"""
+    costs = tree.cost_array
+    for n in tree.nodes:
+        if n.parent is None:
+            assert costs[n.index] == 0
+        else:
+            assert costs[n.index] == pytest.approx(n.parent.cost + n._newcost)
+        assert n.cost == costs[n.index]
+    goal_costs = [n.cost for n in tree.goal_nodes]
+    best = tree.best_goal
+    if len(goal_costs) == 0 or np.isinf(min(goal_costs)):
+        assert best is None
+    else:
+        assert best.is_goal is True
+        assert best.cost == min(goal_costs)
+
+
+def _check_links(tree):
+    """Checks the parent array and child positions against the nodes"""
+    parents = tree.parent_array
+    for n in tree.nodes:
+        if n.parent is None:
+            assert parents[n.index] == -1
+        else:
+            assert parents[n.index] == n.parent.index
+            assert n.parent.children[n._child_idx] is n
+        for c in n.children:
+            assert c.parent is n
+
+
+def test_free_and_goal_nodes():
+    tree, nodes, rs = _random_tree(300)
+    for _ in range(500):
+        nodes[rs.randint(len(nodes))].mark_goal(bool(rs.rand() < .5))
+    # Both lists stay in node order, as if filtered from nodes
+    assert tree.free_nodes == [n for n in nodes if n.is_goal is False]
+    assert tree.goal_nodes == [n for n in nodes if n.is_goal is True]
+    # Changing the returned lists leaves the tree alone
+    free, goals = tree.free_nodes, tree.goal_nodes
+    free.pop()
+    goals.sort(key=lambda n: n.cost)
+    assert tree.free_nodes == [n for n in nodes if n.is_goal is False]
+    assert tree.goal_nodes == [n for n in nodes if n.is_goal is True]
+
+
+def test_terminals():
+    tree, nodes, rs = _random_tree(300)
+    leaves = set(n for n in nodes if len(n.children) == 0)
+    assert len(leaves) > 1
+    assert set(tree.terminals) == leaves
+    # The cached list can't be changed from outside
+    tree.terminals.pop()
+    assert set(tree.terminals) == leaves
+    # And it follows the tree as it changes shape
+    leaf = nodes[-1]
+    child = tree.add_node(leaf, rs.rand(2))
+    leaves = (leaves - set([leaf])) | set([child])
+    assert set(tree.terminals) == leaves
+    parent = child.parent
+    child.reparent(tree.head)
+    assert set(tree.terminals) == leaves | set([parent])
+
+
+def test_recost():
+    tree, nodes, rs = _random_tree(200)
+    goals = [nodes[i] for i in rs.choice(len(nodes), 20, replace=False)]
+    for n in goals:
+        n.mark_goal()
+    _check_costs(tree)
+    for _ in range(100):
+        # Move a subtree holding a goal under some node outside of it
+        goal = goals[rs.randint(len(goals))]
+        node = goal
+        for _ in range(rs.randint(4)):
+            if node.parent is not None:
+                node = node.parent
+        if node.parent is None:
+            continue
+        inside = set(_subtree(node))
+        outside = [n for n in nodes if n not in inside]
+        cost = np.inf if rs.rand() < .2 else rs.rand()
+        node.reparent(outside[rs.randint(len(outside))], cost)
+        _check_costs(tree)
+        assert goal.cost == pytest.approx(sum(n._newcost for n in
+                                              tree.path_down(goal)[1:]))
+    # Edges going from inf back to finite costs shift nothing by inf
+    for n in nodes:
+        if n.parent is not None and np.isinf(n._newcost):
+            n.reparent(n.parent, rs.rand())
+            _check_costs(tree)
+    assert np.all(np.isfinite(tree.cost_array))
+
+
+def test_reparent():
+    tree, nodes, rs = _random_tree(200)
+    goals = [nodes[i] for i in rs.choice(len(nodes), 20, replace=False)]
+    for n in goals:
+        n.mark_goal()
+    for _ in range(300):
+        # Move goals half of the time, and set some edges to inf
+        if rs.rand() < .5:
+            node = goals[rs.randint(len(goals))]
+        else:
+            node = nodes[rs.randint(len(nodes))]
+        if node.parent is None:
+            continue
+        inside = set(_subtree(node))
+        outside = [n for n in nodes if n not in inside]
+        cost = np.inf if rs.rand() < .1 else rs.rand()
+        node.reparent(outside[rs.randint(len(outside))], cost)
+        _check_links(tree)
+        _check_costs(tree)
+    # Every node is still reachable from the head
+    assert len(_subtree(tree.head)) == len(nodes)
+
+
+def test_get_node():
+    tree, nodes, rs = _random_tree(50)
+    for n in nodes:
+        assert tree.get_node(n.point) is n
+        assert tree.get_node(list(n.point)) is n
+    with pytest.warns(RuntimeWarning):
+        assert tree.get_node([2., 2.]) is None